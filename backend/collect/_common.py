@@ -0,0 +1,176 @@
+"""
+Terraform File Collection Pipeline - Shared Helpers
+
+Logging setup, config loading, repository enumeration and the retrying
+worker pool used by every pipeline stage.
+"""
+
+import os
+import sys
+import json
+import yaml
+import logging
+import platform
+import stat
+import time
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Prefer the LibYAML C parser when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+logger = logging.getLogger(__name__)
+
+# Directory holding the stage scripts; repos/ and repos.yaml live here
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def setup_logging():
+    """Configure logging based on LOG_LEVEL environment variable."""
+    log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
+    logging.basicConfig(
+        level=getattr(logging, log_level, logging.INFO),
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    return logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def load_config(config_path='config.yaml'):
+    """Load configuration from YAML file, or JSON on stdin when config_path is '-'.
+
+    Each path is parsed once per process, so stages running in the same
+    process share one config dict; callers must not modify it.
+    """
+    try:
+        if config_path == '-':
+            # main.py --isolate passes the already-parsed config as JSON
+            return json.load(sys.stdin.buffer)
+        with open(config_path, 'r') as f:
+            config = yaml.load(f, Loader=SafeLoader)
+        return config
+    except json.JSONDecodeError as e:
+        logging.error("Error parsing JSON config from stdin: %s", e)
+        sys.exit(1)
+    except FileNotFoundError:
+        logging.error("Configuration file %s not found", config_path)
+        sys.exit(1)
+    except yaml.YAMLError as e:
+        logging.error("Error parsing YAML config: %s", e)
+        sys.exit(1)
+
+
+# RAM-backed filesystems used when use_tmpfs is enabled
+TMPFS_DIRS = {
+    'Linux': '/dev/shm',
+    'Darwin': '/Volumes/RAMDisk',
+}
+
+
+def make_private_dir(path):
+    """Create path as a directory only the current user can access.
+
+    The mode only applies when the directory is new, so an existing one is
+    checked instead: it must be a real directory (not a symlink), owned by
+    the current user, with no group or other permissions. Returns True if
+    path is safe to use.
+    """
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        st = os.lstat(path)
+    except OSError as e:
+        logger.warning("Could not create private directory %s: %s", path, e)
+        return False
+    
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        logger.warning("Not using %s: it must be a directory owned by the current user with mode 0700", path)
+        return False
+    return True
+
+
+def get_repos_dir(config):
+    """Get the directory that holds cloned repositories.
+
+    With use_tmpfs enabled, clones are placed on a RAM-backed filesystem
+    (/dev/shm on Linux, a RAM disk mounted at /Volumes/RAMDisk on macOS),
+    inside a per-user directory that other users can't read. State files
+    pulled there contain secrets.
+    """
+    if config.get('use_tmpfs'):
+        ram_dir = TMPFS_DIRS.get(platform.system())
+        if ram_dir and os.path.isdir(ram_dir):
+            user_dir = os.path.join(ram_dir, f'terraform-ui-{os.getuid()}')
+            if make_private_dir(user_dir):
+                return os.path.join(user_dir, 'repos')
+            logger.warning("Using local repos directory instead of %s", ram_dir)
+        else:
+            logger.warning("use_tmpfs is set but no RAM-backed filesystem is available, using local repos directory")
+    return os.path.join(SCRIPT_DIR, 'repos')
+
+
+def _list_subdirs(path):
+    """List non-hidden subdirectories of path, using the types scandir reports."""
+    with os.scandir(path) as entries:
+        return [
+            entry.path
+            for entry in entries
+            if entry.is_dir(follow_symlinks=False) and not entry.name.startswith('.')
+        ]
+
+
+def enumerate_repos(repos_dir):
+    """List the cloned repository directories, laid out as repos/<project>/<repo>.
+
+    Hidden entries such as .git-template are skipped at both levels.
+    """
+    repo_dirs = []
+    for project_dir in _list_subdirs(repos_dir):
+        repo_dirs.extend(_list_subdirs(project_dir))
+    return repo_dirs
+
+
+def retry_settings(config):
+    """Read the retry count and initial backoff (seconds) from the config."""
+    return config.get('retries', 1), config.get('retry_backoff', 1)
+
+
+def run_with_retry(items, fn, retries=1, executor=None, max_workers=8, backoff=0):
+    """Call fn(item) for every item on a thread pool, retrying the failures.
+
+    fn returns True on success. Failed items are retried up to retries more
+    times on the same pool, waiting backoff seconds before the first retry
+    and doubling the wait before each later one. A caller-provided executor
+    is reused and left running; otherwise a pool of max_workers threads is
+    created for the call.
+
+    Returns (successful, failed) sets of items.
+    """
+    successful = set()
+    pending = set(items)
+    
+    pool = executor or ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for attempt in range(retries + 1):
+            if not pending:
+                break
+            if attempt:
+                delay = backoff * 2 ** (attempt - 1)
+                logger.info("Retrying %s failed repositories in %ss", len(pending), delay)
+                time.sleep(delay)
+            
+            futures = {pool.submit(fn, item): item for item in pending}
+            pending = set()
+            for future in as_completed(futures):
+                item = futures[future]
+                if future.result():
+                    successful.add(item)
+                else:
+                    pending.add(item)
+    finally:
+        if executor is None:
+            pool.shutdown()
+    
+    return successful, pending
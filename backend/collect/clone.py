@@ -12,174 +12,431 @@ Environment Variables:
 """
 
 import os
+import re
 import sys
-import yaml
+import json
 import logging
 import time
 import platform
-import git
+import shutil
+import subprocess
+import threading
+from functools import lru_cache, partial
 
+from _common import setup_logging, load_config, get_repos_dir, make_private_dir, retry_settings, run_with_retry
 
-def setup_logging():
-    """Configure logging based on LOG_LEVEL environment variable."""
-    log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
-    logging.basicConfig(
-        level=getattr(logging, log_level, logging.INFO),
-        format='%(asctime)s - %(levelname)s - %(message)s'
-    )
-    return logging.getLogger(__name__)
+logger = logging.getLogger(__name__)
 
 
-def load_config(config_path='config.yaml'):
-    """Load configuration from YAML file."""
-    try:
-        with open(config_path, 'r') as f:
-            config = yaml.safe_load(f)
-        return config
-    except FileNotFoundError:
-        logging.error(f"Configuration file {config_path} not found")
-        sys.exit(1)
-    except yaml.YAMLError as e:
-        logging.error(f"Error parsing YAML config: {e}")
-        sys.exit(1)
+# git@github.com:org/repo.git -> ('org', 'repo')
+SSH_URL_RE = re.compile(r'^git@[^:]+:([^/:]+)/([^/:]+?)(?:\.git)?(?:[/:]|$)')
 
 
+@lru_cache(maxsize=None)
 def extract_repo_info(git_url):
-    """Extract project and repository name from Git SSH URL."""
+    """Extract project and repository name from Git SSH URL.
+
+    Results are cached since the same URL is parsed again on retry.
+    """
     # Handle git@github.com:org/repo.git format
     if git_url.startswith('git@'):
-        # Extract the part after the colon
-        path_part = git_url.split(':')[1]
-        # Remove .git suffix if present
-        if path_part.endswith('.git'):
-            path_part = path_part[:-4]
-        # Split into project and repo
-        parts = path_part.split('/')
-        if len(parts) >= 2:
-            project = parts[0]
-            repo = parts[1]
-            return project, repo
-        else:
-            logging.error(f"Invalid URL format: {git_url}")
-            return None, None
+        match = SSH_URL_RE.match(git_url)
+        if match:
+            return match.group(1), match.group(2)
+        logging.error("Invalid URL format: %s", git_url)
+        return None, None
     else:
-        logging.error(f"Unsupported URL format: {git_url}. Only SSH URLs are supported.")
+        logging.error("Unsupported URL format: %s. Only SSH URLs are supported.", git_url)
         return None, None
 
 
-def get_repo_path(base_dir, project, repo):
+SPARSE_PATTERNS = ['*.tf', '**/*.tf']
+
+# Records the remote HEAD each clone was made from, relative to the repos dir
+HEAD_CACHE_FILE = '.cache.json'
+
+# git stderr that indicates the remote is throttling us: an HTTP 429 status
+# (e.g. "The requested URL returned error: 429") or a rate-limit message.
+# Bare numbers and connection resets are ordinary failures, retried as usual.
+RATE_LIMIT_RE = re.compile(
+    r'too many requests|rate[ -]?limit|\b(?:error:?|http(?:/[\d.]+)?)\s*429\b',
+    re.IGNORECASE
+)
+
+
+def validate_repositories(repositories):
+    """Split configured URLs into (valid, invalid) lists in a single pass.
+
+    Duplicate URLs, and URLs that would clone into the same repos/<project>/<repo>
+    directory, are dropped so that no two workers write to the same path.
+    """
+    valid = []
+    invalid = []
+    seen_paths = {}
+    
+    for git_url in dict.fromkeys(repositories):
+        project, repo = extract_repo_info(git_url)
+        if not project or not repo:
+            invalid.append(git_url)
+            continue
+        
+        previous = seen_paths.setdefault((project, repo), git_url)
+        if previous != git_url:
+            logger.warning("Skipping %s: clones into the same directory as %s", git_url, previous)
+            continue
+        
+        valid.append(git_url)
+    
+    return valid, invalid
+
+
+def get_repo_path(repos_dir, project, repo):
     """Get the path where repository should be cloned."""
-    return os.path.join(base_dir, "repos", project, repo)
+    return os.path.join(repos_dir, project, repo)
+
+
+def prepare_clone_template(repos_dir):
+    """Create a git template directory that seeds the sparse-checkout patterns.
+
+    Cloning with this template and core.sparseCheckout enabled applies the
+    patterns during the clone's own checkout, so no follow-up git calls are
+    needed per repository.
+    """
+    template_dir = os.path.join(repos_dir, ".git-template")
+    info_dir = os.path.join(template_dir, "info")
+    os.makedirs(info_dir, exist_ok=True)
+    
+    with open(os.path.join(info_dir, "sparse-checkout"), 'w') as f:
+        f.write('\n'.join(SPARSE_PATTERNS) + '\n')
+    
+    return template_dir
+
+
+@lru_cache(maxsize=None)
+def git_executable():
+    """Resolve the git binary once so every spawn gets an absolute path."""
+    return shutil.which('git') or 'git'
+
+
+def run_git(args, timeout=600, capture_output=False):
+    """Run a git command, raising CalledProcessError with stderr on failure.
+
+    The call keeps to what lets CPython spawn via posix_spawn instead of
+    fork+exec: an absolute executable, no cwd (callers use 'git -C'),
+    close_fds=False (Python creates fds non-inheritable) and no text-mode
+    wrapper. stderr is left as bytes and only decoded when reporting errors.
+    stdout is discarded unless capture_output is set.
+    """
+    cmd = [git_executable()] + args
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Running command: %s", ' '.join(cmd))
+    
+    return subprocess.run(
+        cmd,
+        check=True,
+        stdout=subprocess.PIPE if capture_output else subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        close_fds=False,
+        timeout=timeout
+    )
+
+
+def load_head_cache(repos_dir):
+    """Load the url -> HEAD SHA map recorded by the previous clone run."""
+    cache_path = os.path.join(repos_dir, HEAD_CACHE_FILE)
+    try:
+        with open(cache_path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning("Ignoring unreadable clone cache %s: %s", cache_path, e)
+        return {}
+
+
+def save_head_cache(repos_dir, head_cache, repositories):
+    """Atomically write the url -> HEAD SHA map for the next run.
+
+    Only the URLs in repositories are kept, so repositories that were
+    removed from the config drop out of the cache.
+    """
+    cache_path = os.path.join(repos_dir, HEAD_CACHE_FILE)
+    tmp_path = cache_path + '.tmp'
+    current = {url: head_cache[url] for url in repositories if url in head_cache}
+    with open(tmp_path, 'w') as f:
+        json.dump(current, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, cache_path)
+
+
+def get_remote_head(git_url):
+    """Return the SHA the remote's HEAD points to, or None if it can't be read."""
+    try:
+        result = run_git(['ls-remote', git_url, 'HEAD'], timeout=60, capture_output=True)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        logger.debug("Could not read remote HEAD of %s: %s", git_url, e)
+        return None
+    
+    fields = result.stdout.split()
+    return fields[0].decode() if fields else None
+
+
+class TokenBucket:
+    """Thread-safe token bucket that limits how many clones start per second."""
+    
+    def __init__(self, rate, burst=1, min_rate=0.05):
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self.min_rate = min_rate
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.condition = threading.Condition()
+        
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        
+    def acquire(self):
+        """Block until a token is available, then consume it."""
+        with self.condition:
+            self._refill()
+            while self.tokens < 1:
+                self.condition.wait((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+            
+    def throttle(self):
+        """Halve the refill rate after the remote pushes back. Returns the new rate."""
+        with self.condition:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            return self.rate
+
+
+def create_rate_limiter(config):
+    """Build the clone TokenBucket from config, or None when unlimited.
+
+    clones_per_second takes precedence; otherwise the legacy rate_limit
+    setting (seconds between clones) is converted to a rate.
+    """
+    rate = config.get('clones_per_second')
+    if rate is None:
+        rate_limit = config.get('rate_limit', 0.1)
+        rate = 1 / rate_limit if rate_limit and rate_limit > 0 else 0
+    
+    if rate <= 0:
+        return None
+    
+    return TokenBucket(rate, config.get('burst', 1))
+
 
+def configure_ssh_multiplexing(config):
+    """Make git's ssh share one connection per host via OpenSSH ControlMaster.
 
-def clone_repository(git_url, base_dir, rate_limit=0.1):
-    """Clone a single repository with sparse checkout for .tf files."""
-    logger = logging.getLogger(__name__)
+    The first clone to a host opens the master connection; later clones
+    tunnel over it and skip the TCP and authentication handshake. An existing
+    GIT_SSH_COMMAND or GIT_SSH is left untouched.
+    """
+    if not config.get('ssh_multiplexing', True):
+        return
     
+    if platform.system() == 'Windows':
+        logger.debug("SSH multiplexing is not supported on Windows, skipping")
+        return
+    
+    if os.environ.get('GIT_SSH_COMMAND') or os.environ.get('GIT_SSH'):
+        logger.debug("GIT_SSH_COMMAND/GIT_SSH already set, not enabling SSH multiplexing")
+        return
+    
+    # Unix socket paths are length-limited, so keep this short and use the
+    # %C connection hash rather than user@host:port
+    control_dir = f"/tmp/terraform-ui-ssh-{os.getuid()}"
+    # Socket names are predictable, so a directory another user could write
+    # to would let them plant a socket that ssh connects to
+    if not make_private_dir(control_dir):
+        logger.warning("Not enabling SSH multiplexing")
+        return
+    persist = config.get('ssh_control_persist', '600s')
+    
+    os.environ['GIT_SSH_COMMAND'] = (
+        f"ssh -o ControlMaster=auto -o ControlPath={control_dir}/%C -o ControlPersist={persist}"
+    )
+    logger.debug("Enabled SSH multiplexing: %s", os.environ['GIT_SSH_COMMAND'])
+
+
+def update_repository(repo_path):
+    """Bring an existing shallow clone up to date with the remote HEAD.
+
+    The fetch reuses the clone's partial-clone filter and sparse patterns, so
+    only changed .tf blobs are downloaded. Returns False without touching the
+    directory when it is not a usable git repository; other git failures
+    raise CalledProcessError.
+    """
+    if not os.path.isdir(os.path.join(repo_path, '.git')):
+        return False
+    
+    # The fetch doubles as the repository check, saving a separate
+    # 'git rev-parse --git-dir' process per existing clone
+    try:
+        run_git(['-C', repo_path, '-c', 'core.fsync=none', 'fetch', '--depth=1', '--no-tags', 'origin'])
+    except subprocess.CalledProcessError as e:
+        if e.stderr and b'not a git repository' in e.stderr:
+            return False
+        raise
+    
+    run_git(['-C', repo_path, '-c', 'core.fsync=none', 'reset', '--hard', 'origin/HEAD'])
+    return True
+
+
+def clone_repository(git_url, repos_dir, template_dir, rate_limiter=None, head_cache=None):
+    """Clone a single repository with sparse checkout for .tf files.
+
+    When head_cache says the existing clone was made from the commit the
+    remote HEAD still points to, the clone is skipped. An existing clone is
+    updated in place; it is only removed and re-cloned when it is not a
+    usable git repository. head_cache is updated in place on success.
+    """
     project, repo = extract_repo_info(git_url)
     if not project or not repo:
         return False
     
-    repo_path = get_repo_path(base_dir, project, repo)
+    repo_path = get_repo_path(repos_dir, project, repo)
     
     try:
-        logger.info(f"Cloning {git_url}")
+        # Every path below contacts the remote (ls-remote, fetch or clone),
+        # so take the token first
+        if rate_limiter:
+            rate_limiter.acquire()
+        
+        remote_head = None
+        if head_cache is not None:
+            remote_head = get_remote_head(git_url)
+            if (remote_head and head_cache.get(git_url) == remote_head
+                    and os.path.isdir(os.path.join(repo_path, '.git'))):
+                logger.info("%s/%s is up to date at %s, skipping clone", project, repo, remote_head[:12])
+                return True
+        
+        if update_repository(repo_path):
+            logger.info("Successfully updated existing clone of %s/%s", project, repo)
+            if head_cache is not None and remote_head:
+                head_cache[git_url] = remote_head
+            return True
+        
+        if os.path.exists(repo_path):
+            logger.warning("Removing unusable clone at %s", repo_path)
+            shutil.rmtree(repo_path)
+        
+        logger.info("Cloning %s", git_url)
         
         # Create directory if it doesn't exist
         os.makedirs(repo_path, exist_ok=True)
         
-        # Clone with sparse checkout enabled from the start
-        git_repo = git.Repo.clone_from(
+        # Partial clone: trees are needed to resolve sparse patterns, but only
+        # the blobs matched by those patterns are downloaded on checkout.
+        # Tags are skipped so the fetch negotiates a single ref. Clones are
+        # disposable (a corrupt one is simply re-cloned), so git's fsyncs of
+        # the pack and index are skipped.
+        logger.debug("Sparse checkout for %s/%s: %s", project, repo, SPARSE_PATTERNS)
+        run_git([
+            'clone',
+            f'--template={template_dir}',
+            '-c', 'core.sparseCheckout=true',
+            '-c', 'core.fsync=none',
+            '--depth=1',
+            '--no-tags',
+            '--filter=blob:none',
             git_url,
-            repo_path,
-            no_checkout=True,
-            depth=1,
-            filter='tree:0'
-        )
-        
-        # Configure sparse checkout for .tf files only
-        logger.info(f"Setting sparse checkout for {project}/{repo} to *.tf files")
-        git_repo.git.sparse_checkout('set', '--no-cone', '*.tf', '**/*.tf')
-        
-        # Checkout the files
-        git_repo.git.checkout()
+            repo_path
+        ])
         
-        logger.info(f"Successfully cloned {project}/{repo} with sparse checkout for .tf files")
+        logger.info("Successfully cloned %s/%s with sparse checkout for .tf files", project, repo)
         
-        # Rate limiting
-        if rate_limit > 0:
-            logger.debug(f"Rate limiting: waiting {rate_limit} seconds")
-            time.sleep(rate_limit)
+        if head_cache is not None and remote_head:
+            head_cache[git_url] = remote_head
         
         return True
         
+    except subprocess.CalledProcessError as e:
+        logger.error("Failed to clone or update %s: %s", git_url, e)
+        stderr = e.stderr.decode(errors='replace').strip() if e.stderr else ''
+        if stderr:
+            logger.error("git stderr: %s", stderr)
+        if rate_limiter and RATE_LIMIT_RE.search(stderr):
+            new_rate = rate_limiter.throttle()
+            logger.warning("Remote is rate limiting, reducing clone rate to %.2f/s", new_rate)
+        return False
     except Exception as e:
-        logger.error(f"Failed to clone {git_url}: {e}")
+        logger.error("Failed to clone %s: %s", git_url, e)
         return False
 
 
-def main():
-    """Main function to orchestrate the cloning process."""
-    logger = setup_logging()
-    
-    # Get config file path from command line or use default
-    config_path = sys.argv[1] if len(sys.argv) > 1 else 'config.yaml'
-    
+def run(config):
+    """Run the clone stage for an already-loaded config. Returns True on success."""
     logger.info("Starting Terraform file collection - Clone stage")
-    logger.info(f"Platform: {platform.system()}")
-    
-    # Load configuration
-    config = load_config(config_path)
+    logger.info("Platform: %s", platform.system())
     
     if 'repositories' not in config:
         logger.error("No 'repositories' section found in config")
-        sys.exit(1)
+        return False
     
-    repositories = config['repositories']
-    rate_limit = config.get('rate_limit', 0.1)
+    repositories, invalid_urls = validate_repositories(config['repositories'])
+    rate_limiter = create_rate_limiter(config)
+    max_workers = config.get('max_concurrent_clones', 8)
     
-    logger.info(f"Found {len(repositories)} repositories to clone")
+    logger.info("Found %s repositories to clone", len(repositories))
+    if invalid_urls:
+        logger.warning("Skipping %s repositories with unsupported URLs", len(invalid_urls))
     
     # Get base directory for cloning
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    
-    # Track results
-    successful_clones = []
-    failed_clones = []
-    retry_queue = []
-    
-    # First pass: clone all repositories
-    for repo_url in repositories:
-        if clone_repository(repo_url, script_dir, rate_limit):
-            successful_clones.append(repo_url)
-        else:
-            failed_clones.append(repo_url)
-            retry_queue.append(repo_url)
-    
-    # Retry failed clones once
-    if retry_queue:
-        logger.info(f"Retrying {len(retry_queue)} failed repositories")
-        retry_failed = []
-        
-        for repo_url in retry_queue:
-            logger.info(f"Retrying {repo_url}")
-            if clone_repository(repo_url, script_dir, rate_limit):
-                successful_clones.append(repo_url)
-                failed_clones.remove(repo_url)
-            else:
-                retry_failed.append(repo_url)
+    repos_dir = get_repos_dir(config)
+    logger.info("Cloning into %s", repos_dir)
+    template_dir = prepare_clone_template(repos_dir)
+    configure_ssh_multiplexing(config)
+    head_cache = load_head_cache(repos_dir)
+    
+    # Clones are network-bound, so they run on a bounded thread pool. Workers
+    # share one rate limiter, so the limit holds regardless of pool size.
+    # Failed clones are retried with backoff.
+    clone = partial(
+        clone_repository, repos_dir=repos_dir, template_dir=template_dir,
+        rate_limiter=rate_limiter, head_cache=head_cache
+    )
+    retries, backoff = retry_settings(config)
+    successful_clones, failed_clones = run_with_retry(
+        repositories, clone, retries=retries, max_workers=max_workers, backoff=backoff
+    )
+    
+    save_head_cache(repos_dir, head_cache, repositories)
+    
+    # Invalid URLs are never attempted, but still fail the stage
+    failed_clones.update(invalid_urls)
     
     # Summary
-    logger.info(f"Clone stage completed:")
-    logger.info(f"  Successful: {len(successful_clones)}")
-    logger.info(f"  Failed: {len(failed_clones)}")
+    logger.info("Clone stage completed:")
+    logger.info("  Successful: %s", len(successful_clones))
+    logger.info("  Failed: %s", len(failed_clones))
     
     if failed_clones:
-        logger.warning(f"Failed to clone: {failed_clones}")
+        logger.warning("Failed to clone: %s", sorted(failed_clones))
+        return False
+    
+    logger.info("All repositories cloned successfully")
+    return True
+
+
+def main():
+    """Main function to orchestrate the cloning process."""
+    setup_logging()
+    
+    # Get config file path from command line or use default
+    config_path = sys.argv[1] if len(sys.argv) > 1 else 'config.yaml'
+    
+    # Load configuration
+    config = load_config(config_path)
+    
+    if not run(config):
         sys.exit(1)
-    else:
-        logger.info("All repositories cloned successfully")
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -5,12 +5,20 @@ Terraform File Collection Pipeline - Main Orchestrator
 This script orchestrates the complete pipeline by running clone, override, and pull stages in sequence.
 Optionally includes repository discovery stage if --discover flag is provided.
 
+Stages run in-process by default, so the config is parsed once and module
+imports (yaml, requests) are shared. Pass --isolate to run each stage as a
+separate Python process instead.
+
 Usage:
     python main.py [config.yaml]
     python main.py --discover [config.yaml]
+    python main.py --isolate [config.yaml]
+    python main.py --force-init [config.yaml]
     
 Options:
     --discover    Run repository discovery before clone stage
+    --isolate     Run each stage in its own subprocess
+    --force-init  Run terraform init in the pull stage even where providers are already installed
     
 Environment Variables:
     LOG_LEVEL - Set to DEBUG or INFO for different verbosity levels
@@ -18,85 +26,134 @@ Environment Variables:
 
 import os
 import sys
+import json
 import logging
 import subprocess
 
+from _common import SCRIPT_DIR, setup_logging, load_config
 
-def setup_logging():
-    """Configure logging based on LOG_LEVEL environment variable."""
-    log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
-    logging.basicConfig(
-        level=getattr(logging, log_level, logging.INFO),
-        format='%(asctime)s - %(levelname)s - %(message)s'
-    )
-    return logging.getLogger(__name__)
+logger = logging.getLogger(__name__)
 
 
-def run_stage(stage_script, config_path):
-    """Run a pipeline stage script."""
-    logger = logging.getLogger(__name__)
-    
-    script_path = os.path.join(os.path.dirname(__file__), stage_script)
-    cmd = [sys.executable, script_path, config_path]
+def run_stage(stage_script, config):
+    """Run a pipeline stage script, passing the parsed config as JSON on stdin."""
+    script_path = os.path.join(SCRIPT_DIR, stage_script)
+    cmd = [sys.executable, script_path, '-']
     
     logger.info(f"Running {stage_script}...")
     
     try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        # close_fds=False keeps subprocess on its posix_spawn fast path
+        result = subprocess.run(
+            cmd,
+            # YAML dates/timestamps have no JSON form; pass them as strings
+            input=json.dumps(config, default=str).encode(),
+            check=True,
+            capture_output=True,
+            close_fds=False
+        )
         if result.stdout:
-            logger.info(f"{stage_script} output: {result.stdout.strip()}")
+            logger.info(f"{stage_script} output: {result.stdout.decode(errors='replace').strip()}")
         return True
     except subprocess.CalledProcessError as e:
         logger.error(f"{stage_script} failed: {e}")
         if e.stderr:
-            logger.error(f"{stage_script} stderr: {e.stderr}")
+            logger.error(f"{stage_script} stderr: {e.stderr.decode(errors='replace')}")
         return False
 
 
+def run_discovery(config, isolate=False):
+    """Run repository discovery, writing repos.yaml. Returns True on success.
+
+    repos is imported only here, so requests is only needed with --discover.
+    """
+    if isolate:
+        return run_stage('repos.py', config)
+    
+    import repos
+    return repos.run(config)
+
+
+def run_isolated(config):
+    """Run each stage as a separate Python process. Returns True on success."""
+    for stage in ('clone.py', 'override.py', 'pull.py'):
+        if not run_stage(stage, config):
+            logger.error(f"Pipeline failed at stage: {stage}")
+            return False
+    
+    return True
+
+
+def run_in_process(config):
+    """Run each stage's run(config) in this process. Returns True on success.
+
+    Stage modules are imported here rather than at the top, so --isolate
+    runs import none of them.
+    """
+    import clone
+    import override
+    import pull
+    
+    for stage in (clone, override, pull):
+        if not stage.run(config):
+            logger.error(f"Pipeline failed at stage: {stage.__name__}.py")
+            return False
+    
+    return True
+
+
 def main():
     """Main function to orchestrate the complete pipeline."""
-    logger = setup_logging()
+    setup_logging()
     
     # Parse command line arguments
     args = sys.argv[1:]
     discover = False
+    isolate = False
+    force_init = False
     config_path = 'config.yaml'
     
     if '--discover' in args:
         discover = True
         args.remove('--discover')
     
+    if '--isolate' in args:
+        isolate = True
+        args.remove('--isolate')
+    
+    if '--force-init' in args:
+        force_init = True
+        args.remove('--force-init')
+    
     if args:
         config_path = args[0]
     
     logger.info("Starting Terraform File Collection Pipeline")
     
-    # Pipeline stages in order
-    stages = []
+    config = load_config(config_path)
     
     if discover:
-        stages.append('repos.py')
-        # Use repos.yaml for subsequent stages if discovery is used
-        subsequent_config = 'repos.yaml'
-    else:
-        subsequent_config = config_path
-    
-    stages.extend([
-        'clone.py',
-        'override.py', 
-        'pull.py'
-    ])
-    
-    for i, stage in enumerate(stages):
-        # Use original config for repos.py, generated repos.yaml for others if discover mode
-        stage_config = config_path if stage == 'repos.py' else (subsequent_config if discover else config_path)
-        
-        if not run_stage(stage, stage_config):
-            logger.error(f"Pipeline failed at stage: {stage}")
+        if not run_discovery(config, isolate):
+            logger.error("Pipeline failed at stage: repos.py")
             sys.exit(1)
+        # Use repos.yaml for subsequent stages; repos.py always writes it
+        # next to the stage scripts
+        config = load_config(os.path.join(SCRIPT_DIR, 'repos.yaml'))
+    
+    if force_init:
+        # load_config results are shared, so override on a copy
+        config = dict(config, force_init=True)
+    
+    if isolate:
+        success = run_isolated(config)
+    else:
+        success = run_in_process(config)
+    
+    if not success:
+        sys.exit(1)
     
     logger.info("Terraform File Collection Pipeline completed successfully")
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -14,141 +14,330 @@ Environment Variables:
 
 import os
 import sys
+import errno
 import logging
+import stat
 import shutil
 import platform
-from glob import glob
+import subprocess
+from functools import lru_cache, partial
 
+from _common import SCRIPT_DIR, setup_logging, load_config, get_repos_dir, enumerate_repos, run_with_retry
 
-def setup_logging():
-    """Configure logging based on LOG_LEVEL environment variable."""
-    log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
-    logging.basicConfig(
-        level=getattr(logging, log_level, logging.INFO),
-        format='%(asctime)s - %(levelname)s - %(message)s'
-    )
-    return logging.getLogger(__name__)
+logger = logging.getLogger(__name__)
 
+# Project root directory (two levels up from backend/collect)
+PROJECT_ROOT = os.path.dirname(os.path.dirname(SCRIPT_DIR))
+AWS_OVERRIDES_DIR = os.path.join(PROJECT_ROOT, 'aws_deployment_overrides')
+K8S_OVERRIDES_DIR = os.path.join(PROJECT_ROOT, 'k8s_deployment_overrides')
 
-def copy_tf_files(source_dir, dest_dir):
-    """Copy all .tf files from source directory to destination directory."""
-    logger = logging.getLogger(__name__)
-    copied_files = []
+
+# errnos meaning copy_file_range can't handle this pair of files
+COPY_FILE_RANGE_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP}
+
+
+def _kernel_copy(src_fd, dst_fd, size):
+    """Copy size bytes between fds without passing the data through Python.
+
+    Raises OSError if fewer than size bytes could be copied.
+    """
+    copied = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < size:
+                n = os.copy_file_range(src_fd, dst_fd, size - copied)
+                if n == 0:
+                    break
+                copied += n
+        except OSError as e:
+            if copied or e.errno not in COPY_FILE_RANGE_UNSUPPORTED:
+                raise
+        if copied == size:
+            return
+        # Some filesystems report 0 bytes on the first call instead of failing;
+        # sendfile picks up from the same offset either way
     
-    if not os.path.exists(source_dir):
-        logger.debug(f"Source directory does not exist: {source_dir}")
-        return copied_files
+    while copied < size:
+        n = os.sendfile(dst_fd, src_fd, copied, size - copied)
+        if n == 0:
+            break
+        copied += n
     
-    tf_files = glob(os.path.join(source_dir, '*.tf'))
+    if copied < size:
+        raise OSError(errno.EIO, f"short copy: {copied} of {size} bytes")
+
+
+# openat()-style opens, so each copy skips re-walking the source and repo paths
+DIR_FD_SUPPORTED = os.open in os.supports_dir_fd and hasattr(os, 'O_DIRECTORY')
+
+
+def open_dir(path):
+    """Open a directory for use as a dir_fd, or return None if that isn't possible."""
+    if not DIR_FD_SUPPORTED:
+        return None
+    try:
+        return os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError:
+        return None
+
+
+def fast_copy(src, dst, src_dir_fd=None, dst_dir_fd=None):
+    """Copy src to dst like shutil.copy2, staying in the kernel where possible.
+
+    Uses os.copy_file_range (which reflinks on btrfs/XFS), then os.sendfile,
+    and falls back to shutil.copy2 where neither is available or supported.
+    When a dir fd is given, the file is opened by name relative to it; the
+    full path is still used for the fallback.
+    """
+    if not hasattr(os, 'sendfile'):
+        shutil.copy2(src, dst)
+        return
     
-    for tf_file in tf_files:
-        filename = os.path.basename(tf_file)
-        dest_path = os.path.join(dest_dir, filename)
-        
+    src_name = os.path.basename(src) if src_dir_fd is not None else src
+    dst_name = os.path.basename(dst) if dst_dir_fd is not None else dst
+    
+    try:
+        src_fd = os.open(src_name, os.O_RDONLY, dir_fd=src_dir_fd)
         try:
-            shutil.copy2(tf_file, dest_path)
-            logger.debug(f"Copied {tf_file} to {dest_path}")
-            copied_files.append(filename)
-        except Exception as e:
-            logger.error(f"Failed to copy {tf_file} to {dest_path}: {e}")
+            st = os.fstat(src_fd)
+            dst_fd = os.open(dst_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644, dir_fd=dst_dir_fd)
+            try:
+                _kernel_copy(src_fd, dst_fd, st.st_size)
+                # Mode and timestamps, as copy2 would, set through the open fd
+                os.fchmod(dst_fd, stat.S_IMODE(st.st_mode))
+                os.utime(dst_fd, ns=(st.st_atime_ns, st.st_mtime_ns))
+            finally:
+                os.close(dst_fd)
+        finally:
+            os.close(src_fd)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def open_source_dirs(overrides):
+    """Open each override source directory once, returning {path: fd}."""
+    source_fds = {}
+    for tf_file, _, _ in overrides:
+        source_dir = os.path.dirname(tf_file)
+        if source_dir not in source_fds:
+            fd = open_dir(source_dir)
+            if fd is not None:
+                source_fds[source_dir] = fd
+    return source_fds
+
+
+def precompute_overrides(source_dirs):
+    """List the override .tf files once per run.
+
+    Returns (source_path, filename, (size, mtime_ns)) tuples; the size and
+    mtime let copies skip destinations that are already up to date. Sources
+    are listed in order, so a later directory's file wins when two
+    directories provide the same filename.
+    """
+    overrides = {}
     
-    return copied_files
+    for source_dir in source_dirs:
+        try:
+            with os.scandir(source_dir) as entries:
+                tf_entries = sorted(
+                    (
+                        entry
+                        for entry in entries
+                        # Like glob, skip hidden files
+                        if entry.name.endswith('.tf') and not entry.name.startswith('.') and entry.is_file()
+                    ),
+                    key=lambda entry: entry.name
+                )
+                for entry in tf_entries:
+                    st = entry.stat()
+                    overrides[entry.name] = (entry.path, entry.name, (st.st_size, st.st_mtime_ns))
+        except FileNotFoundError:
+            logger.debug("Source directory does not exist: %s", source_dir)
+            continue
+        
+        logger.debug("Found %s override files in %s", len(tf_entries), source_dir)
+    
+    return list(overrides.values())
 
 
-def process_repository(repo_dir):
-    """Process a single repository by copying override files."""
-    logger = logging.getLogger(__name__)
+# Below this many files, spawning cp costs more than copying in-process
+CP_BATCH_MIN_FILES = 16
+
+
+@lru_cache(maxsize=None)
+def batch_copy_executable():
+    """Resolve GNU cp for batched copies, or None where it isn't used."""
+    if platform.system() != 'Linux':
+        return None
+    return shutil.which('cp')
+
+
+def batch_copy(overrides, dest_dir):
+    """Copy all override files with one cp process. Returns True on success.
+
+    cp --reflink=auto clones file extents where the filesystem supports it
+    and -p preserves modes and timestamps like shutil.copy2.
+    """
+    cmd = [batch_copy_executable(), '--reflink=auto', '-p']
+    cmd.extend(tf_file for tf_file, _, _ in overrides)
+    cmd.append(dest_dir + os.sep)
     
+    try:
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, close_fds=False)
+        return True
+    except (OSError, subprocess.CalledProcessError) as e:
+        stderr = getattr(e, 'stderr', None) or b''
+        logger.debug("Batched cp into %s failed, copying file by file: %s", dest_dir, stderr.decode(errors='replace').strip() or e)
+        return False
+
+
+def is_up_to_date(override, dest_dir, dest_fd=None):
+    """Check whether the destination copy of an override matches its source size and mtime."""
+    _, filename, signature = override
+    try:
+        if dest_fd is not None:
+            st = os.stat(filename, dir_fd=dest_fd)
+        else:
+            st = os.stat(os.path.join(dest_dir, filename))
+    except OSError:
+        return False
+    return (st.st_size, st.st_mtime_ns) == signature
+
+
+def copy_override_files(overrides, dest_dir, source_fds=None):
+    """Copy precomputed override files into the destination directory.
+
+    Destinations whose size and mtime already match the source are left
+    alone. Large sets are copied by a single cp process on Linux; otherwise,
+    or if that fails, each file is copied in-process, opened relative to the
+    source_fds from open_source_dirs() and a dir fd for dest_dir.
+
+    Returns (copied, unchanged) lists of filenames.
+    """
+    source_fds = source_fds or {}
+    dest_fd = open_dir(dest_dir)
+    
+    try:
+        pending = []
+        unchanged_files = []
+        for override in overrides:
+            if is_up_to_date(override, dest_dir, dest_fd):
+                unchanged_files.append(override[1])
+            else:
+                pending.append(override)
+        
+        if len(pending) >= CP_BATCH_MIN_FILES and batch_copy_executable():
+            if batch_copy(pending, dest_dir):
+                return [filename for _, filename, _ in pending], unchanged_files
+        
+        copied_files = []
+        for tf_file, filename, _ in pending:
+            dest_path = os.path.join(dest_dir, filename)
+            
+            try:
+                fast_copy(tf_file, dest_path, source_fds.get(os.path.dirname(tf_file)), dest_fd)
+                copied_files.append(filename)
+            except Exception as e:
+                logger.error("Failed to copy %s to %s: %s", tf_file, dest_path, e)
+    finally:
+        if dest_fd is not None:
+            os.close(dest_fd)
+    
+    return copied_files, unchanged_files
+
+
+def process_repository(repo_dir, overrides, source_fds=None):
+    """Process a single repository by copying override files."""
     repo_name = os.path.basename(repo_dir)
     
     if not os.path.exists(repo_dir):
-        logger.warning(f"Repository directory does not exist: {repo_dir}")
+        logger.warning("Repository directory does not exist: %s", repo_dir)
         return False
     
-    logger.info(f"Processing repository: {repo_name}")
-    
     try:
-        # Get project root directory (two levels up from backend/collect)
-        project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-        
-        # Copy from aws_deployment_overrides
-        aws_overrides_dir = os.path.join(project_root, 'aws_deployment_overrides')
-        aws_copied = copy_tf_files(aws_overrides_dir, repo_dir)
-        
-        # Copy from k8s_deployment_overrides  
-        k8s_overrides_dir = os.path.join(project_root, 'k8s_deployment_overrides')
-        k8s_copied = copy_tf_files(k8s_overrides_dir, repo_dir)
-        
-        total_copied = len(aws_copied) + len(k8s_copied)
+        copied, unchanged = copy_override_files(overrides, repo_dir, source_fds)
         
-        if total_copied > 0:
-            logger.info(f"Copied {total_copied} override files to {repo_name}")
-            if aws_copied:
-                logger.debug(f"AWS overrides: {aws_copied}")
-            if k8s_copied:
-                logger.debug(f"K8s overrides: {k8s_copied}")
+        # One record per repository rather than one per file, since every
+        # emit takes the handler lock shared by all workers
+        if copied:
+            logger.info("Copied %s override files to %s (%s unchanged)", len(copied), repo_name, len(unchanged))
+            logger.debug("Overrides copied to %s: %s", repo_name, copied)
+        elif unchanged:
+            logger.info("All %s override files are up to date in %s", len(unchanged), repo_name)
         else:
-            logger.info(f"No override files found to copy to {repo_name}")
+            logger.info("No override files found to copy to %s", repo_name)
         
         return True
         
     except Exception as e:
-        logger.error(f"Failed to process repository {repo_name}: {e}")
+        logger.error("Failed to process repository %s: %s", repo_name, e)
         return False
 
 
-def main():
-    """Main function to orchestrate the override process."""
-    logger = setup_logging()
-    
+def run(config):
+    """Run the override stage for an already-loaded config. Returns True on success."""
     logger.info("Starting Terraform file collection - Override stage")
-    logger.info(f"Platform: {platform.system()}")
+    logger.info("Platform: %s", platform.system())
     
     # Find repos directory
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    repos_base_dir = os.path.join(script_dir, 'repos')
+    repos_base_dir = get_repos_dir(config)
     
     if not os.path.exists(repos_base_dir):
-        logger.error(f"Repos directory does not exist: {repos_base_dir}")
+        logger.error("Repos directory does not exist: %s", repos_base_dir)
         logger.error("Please run clone.py first to clone repositories")
-        sys.exit(1)
+        return False
     
     # Find all repository directories
-    repo_dirs = [
-        os.path.join(repos_base_dir, d) 
-        for d in os.listdir(repos_base_dir) 
-        if os.path.isdir(os.path.join(repos_base_dir, d)) and not d.startswith('.')
-    ]
+    repo_dirs = enumerate_repos(repos_base_dir)
     
     if not repo_dirs:
-        logger.warning(f"No repository directories found in {repos_base_dir}")
+        logger.warning("No repository directories found in %s", repos_base_dir)
         logger.info("Override stage completed with no repositories to process")
-        return
+        return True
     
-    logger.info(f"Found {len(repo_dirs)} repositories to process")
+    logger.info("Found %s repositories to process", len(repo_dirs))
     
-    # Track results
-    successful_overrides = []
-    failed_overrides = []
+    # Resolve override files once; the source directories don't change during a run
+    overrides = precompute_overrides([AWS_OVERRIDES_DIR, K8S_OVERRIDES_DIR])
     
-    # Process all repositories
-    for repo_dir in repo_dirs:
-        if process_repository(repo_dir):
-            successful_overrides.append(os.path.basename(repo_dir))
-        else:
-            failed_overrides.append(os.path.basename(repo_dir))
+    # Process all repositories; copies are I/O-bound, so run them on a pool
+    max_workers = min(32, (os.cpu_count() or 1) * 4)
+    source_fds = open_source_dirs(overrides)
+    try:
+        successful_overrides, failed_overrides = run_with_retry(
+            repo_dirs, partial(process_repository, overrides=overrides, source_fds=source_fds),
+            retries=0, max_workers=max_workers
+        )
+    finally:
+        for fd in source_fds.values():
+            os.close(fd)
     
     # Summary
-    logger.info(f"Override stage completed:")
-    logger.info(f"  Successful: {len(successful_overrides)}")
-    logger.info(f"  Failed: {len(failed_overrides)}")
+    logger.info("Override stage completed:")
+    logger.info("  Successful: %s", len(successful_overrides))
+    logger.info("  Failed: %s", len(failed_overrides))
     
     if failed_overrides:
-        logger.warning(f"Failed to process: {failed_overrides}")
+        logger.warning("Failed to process: %s", sorted(os.path.basename(d) for d in failed_overrides))
+        return False
+    
+    logger.info("All repositories processed successfully")
+    return True
+
+
+def main():
+    """Main function to orchestrate the override process."""
+    setup_logging()
+    
+    # Get config file path from command line or use default
+    config_path = sys.argv[1] if len(sys.argv) > 1 else 'config.yaml'
+    
+    # Load configuration
+    config = load_config(config_path)
+    
+    if not run(config):
         sys.exit(1)
-    else:
-        logger.info("All repositories processed successfully")
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -7,6 +7,10 @@ directory to fetch and save .tfstate files locally.
 
 Usage:
     python pull.py [config.yaml]
+    python pull.py --force-init [config.yaml]
+    
+Options:
+    --force-init  Run terraform init even where providers are already installed
     
 Environment Variables:
     LOG_LEVEL - Set to DEBUG or INFO for different verbosity levels
@@ -19,53 +23,68 @@ Prerequisites:
 
 import os
 import sys
-import yaml
 import subprocess
 import logging
 import platform
-from pathlib import Path
+import shutil
+from functools import lru_cache, partial
 
+from _common import setup_logging, load_config, get_repos_dir, enumerate_repos, retry_settings, run_with_retry
 
-def setup_logging():
-    """Configure logging based on LOG_LEVEL environment variable."""
-    log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
-    logging.basicConfig(
-        level=getattr(logging, log_level, logging.INFO),
-        format='%(asctime)s - %(levelname)s - %(message)s'
-    )
-    return logging.getLogger(__name__)
+logger = logging.getLogger(__name__)
 
 
-def load_config(config_path='config.yaml'):
-    """Load configuration from YAML file."""
-    try:
-        with open(config_path, 'r') as f:
-            config = yaml.safe_load(f)
-        return config
-    except FileNotFoundError:
-        logging.error(f"Configuration file {config_path} not found")
-        sys.exit(1)
-    except yaml.YAMLError as e:
-        logging.error(f"Error parsing YAML config: {e}")
-        sys.exit(1)
+def configure_plugin_cache(config):
+    """Point terraform at a shared provider plugin cache via TF_PLUGIN_CACHE_DIR.
 
+    Concurrent terraform init calls then reuse provider downloads instead of
+    each fetching its own copy. An existing TF_PLUGIN_CACHE_DIR wins; setting
+    plugin_cache_dir to an empty value disables the cache.
 
-def check_prerequisites():
-    """Check if required tools are available in PATH."""
-    logger = logging.getLogger(__name__)
+    Sparse clones carry no .terraform.lock.hcl, and without one terraform
+    1.4+ ignores the cache and downloads providers anyway, so
+    TF_PLUGIN_CACHE_MAY_BREAK_DEPENDENCY_LOCK_FILE is set as well (unless
+    already set). init then links cached providers into .terraform/.
+    """
+    if os.environ.get('TF_PLUGIN_CACHE_DIR'):
+        logger.debug(f"Using existing TF_PLUGIN_CACHE_DIR: {os.environ['TF_PLUGIN_CACHE_DIR']}")
+    else:
+        cache_dir = config.get('plugin_cache_dir', '~/.terraform.d/plugin-cache')
+        if not cache_dir:
+            return
+        
+        cache_dir = os.path.expanduser(cache_dir)
+        os.makedirs(cache_dir, exist_ok=True)
+        os.environ['TF_PLUGIN_CACHE_DIR'] = cache_dir
+        logger.debug(f"Using terraform plugin cache: {cache_dir}")
     
+    os.environ.setdefault('TF_PLUGIN_CACHE_MAY_BREAK_DEPENDENCY_LOCK_FILE', 'true')
+
+
+def check_prerequisites(check_versions=False):
+    """Check if required tools are available in PATH.
+
+    Only PATH is searched by default; check_versions additionally runs each
+    tool's --version, which costs a process spawn per tool.
+    """
     required_tools = ['terraform', 'git']
-    missing_tools = []
+    missing_tools = [tool for tool in required_tools if shutil.which(tool) is None]
+    
+    if check_versions:
+        for tool in required_tools:
+            if tool in missing_tools:
+                continue
+            try:
+                subprocess.run([tool, '--version'], 
+                             capture_output=True, 
+                             check=True,
+                             timeout=10)
+            except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired):
+                missing_tools.append(tool)
     
     for tool in required_tools:
-        try:
-            subprocess.run([tool, '--version'], 
-                         capture_output=True, 
-                         check=True,
-                         timeout=10)
+        if tool not in missing_tools:
             logger.debug(f"{tool} is available")
-        except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired):
-            missing_tools.append(tool)
     
     if missing_tools:
         logger.error(f"Missing required tools: {missing_tools}")
@@ -76,26 +95,48 @@ def check_prerequisites():
     return True
 
 
-def run_command(cmd, cwd=None, check=True, timeout=300):
-    """Run a shell command and return the result."""
-    logger = logging.getLogger(__name__)
+@lru_cache(maxsize=None)
+def resolve_executable(name):
+    """Resolve a tool to an absolute path once per run."""
+    return shutil.which(name) or name
+
+
+def run_command(cmd, cwd=None, check=True, timeout=300, stdout=None, capture=True):
+    """Run a shell command and return the result.
+
+    Output is captured as bytes, unless stdout is given a file object, in
+    which case the command writes to it directly and only stderr is captured.
+    Callers that never read stdout pass capture=False so it is discarded
+    unless debug logging wants it; stderr is always kept for errors.
+
+    With cwd left unset, an absolute executable and close_fds=False,
+    subprocess can spawn via posix_spawn; terraform callers pass -chdir
+    instead of cwd for that reason.
+    """
     logger.debug(f"Running command: {' '.join(cmd)} in {cwd or 'current directory'}")
     
+    if stdout is None:
+        if capture or logger.isEnabledFor(logging.DEBUG):
+            stdout = subprocess.PIPE
+        else:
+            stdout = subprocess.DEVNULL
+    
     try:
         result = subprocess.run(
-            cmd,
+            [resolve_executable(cmd[0])] + cmd[1:],
             cwd=cwd,
-            capture_output=True,
-            text=True,
+            stdout=stdout,
+            stderr=subprocess.PIPE,
+            close_fds=False,
             check=check,
             timeout=timeout
         )
         if result.stdout:
-            logger.debug(f"Command output: {result.stdout.strip()}")
+            logger.debug(f"Command output: {result.stdout.decode(errors='replace').strip()}")
         return result
     except subprocess.CalledProcessError as e:
         logger.error(f"Command failed: {' '.join(cmd)}")
-        logger.error(f"Error: {e.stderr}")
+        logger.error(f"Error: {e.stderr.decode(errors='replace')}")
         raise
     except subprocess.TimeoutExpired:
         logger.error(f"Command timed out: {' '.join(cmd)}")
@@ -103,24 +144,74 @@ def run_command(cmd, cwd=None, check=True, timeout=300):
 
 
 def has_terraform_files(repo_dir):
-    """Check if repository has .tf files to process."""
-    tf_files = []
-    for root, dirs, files in os.walk(repo_dir):
-        # Skip .git directory
-        if '.git' in dirs:
-            dirs.remove('.git')
-        tf_files.extend([f for f in files if f.endswith('.tf')])
+    """Check if repository has .tf files to process, stopping at the first match."""
+    stack = [repo_dir]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.tf') and entry.is_file():
+                        return True
+                    # Skip .git directory
+                    if entry.name != '.git' and entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+        except OSError:
+            continue
     
-    return len(tf_files) > 0
+    return False
+
+
+# Touched after each successful init; terraform itself leaves
+# .terraform.lock.hcl alone when the provider selections don't change
+INIT_STAMP = os.path.join('.terraform', '.init-stamp')
+
+
+def init_is_current(repo_dir):
+    """Check whether a previous terraform init still covers the configuration.
+
+    True when the stamp left by the last successful init is at least as new
+    as every .tf file, and the lock file, in the repository root.
+    """
+    try:
+        stamp_mtime = os.stat(os.path.join(repo_dir, INIT_STAMP)).st_mtime_ns
+        with os.scandir(repo_dir) as entries:
+            return all(
+                entry.stat().st_mtime_ns <= stamp_mtime
+                for entry in entries
+                if (entry.name.endswith('.tf') or entry.name == '.terraform.lock.hcl') and entry.is_file()
+            )
+    except OSError:
+        return False
 
 
-def terraform_init(repo_dir):
-    """Run terraform init in the repository directory."""
-    logger = logging.getLogger(__name__)
+def touch_init_stamp(repo_dir):
+    """Record that terraform init just succeeded for the current configuration."""
+    stamp_path = os.path.join(repo_dir, INIT_STAMP)
+    try:
+        os.makedirs(os.path.dirname(stamp_path), exist_ok=True)
+        with open(stamp_path, 'a'):
+            pass
+        os.utime(stamp_path)
+    except OSError as e:
+        # Only costs a redundant init next run
+        logger.debug(f"Could not write init stamp in {repo_dir}: {e}")
+
+
+def terraform_init(repo_dir, force=False):
+    """Run terraform init in the repository directory.
+
+    The init is skipped when init_is_current() reports that providers are
+    already installed for the current configuration, unless force is set.
+    """
+    if not force and init_is_current(repo_dir):
+        logger.debug(f"Skipping terraform init in {repo_dir}, providers are up to date")
+        return True
     
     try:
         logger.debug(f"Running terraform init in {repo_dir}")
-        run_command(['terraform', 'init', '-backend=false'], cwd=repo_dir)
+        run_command(['terraform', f'-chdir={repo_dir}', 'init', '-backend=false'], capture=False)
+        touch_init_stamp(repo_dir)
         return True
     except Exception as e:
         logger.error(f"terraform init failed in {repo_dir}: {e}")
@@ -129,19 +220,18 @@ def terraform_init(repo_dir):
 
 def terraform_state_pull(repo_dir):
     """Run terraform state pull and save to .tfstate file."""
-    logger = logging.getLogger(__name__)
-    
     try:
         logger.debug(f"Running terraform state pull in {repo_dir}")
-        result = run_command(['terraform', 'state', 'pull'], cwd=repo_dir, check=False)
-        
-        # Save state to file even if command returns non-zero (might be empty state)
+        # Stream the state straight into the file rather than buffering it in
+        # memory. The file is kept even if the command returns non-zero (might
+        # be empty state)
         tfstate_path = os.path.join(repo_dir, 'terraform.tfstate')
-        with open(tfstate_path, 'w') as f:
-            f.write(result.stdout)
+        with open(tfstate_path, 'wb') as f:
+            run_command(['terraform', f'-chdir={repo_dir}', 'state', 'pull'], check=False, stdout=f)
+            state_size = f.tell()
         
         # Check if we got actual state data
-        if result.stdout.strip():
+        if state_size:
             logger.debug(f"State data written to {tfstate_path}")
             return True
         else:
@@ -153,10 +243,8 @@ def terraform_state_pull(repo_dir):
         return False
 
 
-def process_repository(repo_dir):
+def process_repository(repo_dir, force_init=False):
     """Process a single repository: init and state pull."""
-    logger = logging.getLogger(__name__)
-    
     repo_name = os.path.basename(repo_dir)
     
     if not os.path.exists(repo_dir):
@@ -171,7 +259,7 @@ def process_repository(repo_dir):
     
     try:
         # Step 1: terraform init
-        if not terraform_init(repo_dir):
+        if not terraform_init(repo_dir, force=force_init):
             return False
         
         # Step 2: terraform state pull
@@ -186,72 +274,46 @@ def process_repository(repo_dir):
         return False
 
 
-def main():
-    """Main function to orchestrate the terraform state pull process."""
-    logger = setup_logging()
-    
-    # Get config file path from command line or use default
-    config_path = sys.argv[1] if len(sys.argv) > 1 else 'config.yaml'
-    
+def run(config, force_init=False):
+    """Run the pull stage for an already-loaded config. Returns True on success.
+
+    terraform init runs everywhere when force_init or the config's
+    force_init is set.
+    """
     logger.info("Starting Terraform file collection - Pull stage")
     logger.info(f"Platform: {platform.system()}")
     
     # Check prerequisites
     if not check_prerequisites():
-        sys.exit(1)
-    
-    # Load configuration (mainly for consistency, we might add pull-specific config later)
-    config = load_config(config_path)
+        return False
     
     # Find repos directory
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    repos_base_dir = os.path.join(script_dir, 'repos')
+    repos_base_dir = get_repos_dir(config)
     
     if not os.path.exists(repos_base_dir):
         logger.error(f"Repos directory does not exist: {repos_base_dir}")
         logger.error("Please run clone.py first to clone repositories")
-        sys.exit(1)
+        return False
     
     # Find all repository directories
-    repo_dirs = [
-        os.path.join(repos_base_dir, d) 
-        for d in os.listdir(repos_base_dir) 
-        if os.path.isdir(os.path.join(repos_base_dir, d)) and not d.startswith('.')
-    ]
+    repo_dirs = enumerate_repos(repos_base_dir)
     
     if not repo_dirs:
         logger.warning(f"No repository directories found in {repos_base_dir}")
         logger.info("Pull stage completed with no repositories to process")
-        return
+        return True
     
     logger.info(f"Found {len(repo_dirs)} repositories to process")
     
-    # Track results
-    successful_pulls = []
-    failed_pulls = []
-    retry_queue = []
-    
-    # First pass: process all repositories
-    for repo_dir in repo_dirs:
-        if process_repository(repo_dir):
-            successful_pulls.append(os.path.basename(repo_dir))
-        else:
-            failed_pulls.append(os.path.basename(repo_dir))
-            retry_queue.append(repo_dir)
+    configure_plugin_cache(config)
+    max_workers = config.get('pull_concurrency', 8)
     
-    # Retry failed pulls once
-    if retry_queue:
-        logger.info(f"Retrying {len(retry_queue)} failed repositories")
-        retry_failed = []
-        
-        for repo_dir in retry_queue:
-            repo_name = os.path.basename(repo_dir)
-            logger.info(f"Retrying {repo_name}")
-            if process_repository(repo_dir):
-                successful_pulls.append(repo_name)
-                failed_pulls.remove(repo_name)
-            else:
-                retry_failed.append(repo_name)
+    # Process all repositories, retrying failed pulls with backoff
+    process = partial(process_repository, force_init=force_init or config.get('force_init', False))
+    retries, backoff = retry_settings(config)
+    successful_pulls, failed_pulls = run_with_retry(
+        repo_dirs, process, retries=retries, max_workers=max_workers, backoff=backoff
+    )
     
     # Summary
     logger.info(f"Pull stage completed:")
@@ -259,11 +321,32 @@ def main():
     logger.info(f"  Failed: {len(failed_pulls)}")
     
     if failed_pulls:
-        logger.warning(f"Failed to process: {failed_pulls}")
+        logger.warning(f"Failed to process: {sorted(os.path.basename(d) for d in failed_pulls)}")
+        return False
+    
+    logger.info("All repositories processed successfully")
+    return True
+
+
+def main():
+    """Main function to orchestrate the terraform state pull process."""
+    setup_logging()
+    
+    # Parse command line arguments
+    args = sys.argv[1:]
+    force_init = '--force-init' in args
+    if force_init:
+        args.remove('--force-init')
+    
+    # Get config file path from command line or use default
+    config_path = args[0] if args else 'config.yaml'
+    
+    # Load configuration (mainly for consistency, we might add pull-specific config later)
+    config = load_config(config_path)
+    
+    if not run(config, force_init):
         sys.exit(1)
-    else:
-        logger.info("All repositories processed successfully")
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -23,7 +23,9 @@ Configuration format:
         app_password: "your-app-password"
         workspaces:
           - name: "workspace-name"
-            repo_pattern: "terraform-.*"
+            repo_patterns:
+              - "terraform-.*"
+              - ".*-infrastructure"
 
 Environment Variables:
     LOG_LEVEL - Set to DEBUG or INFO for different verbosity levels
@@ -33,166 +35,505 @@ Environment Variables:
 
 import os
 import sys
-import yaml
+import json
 import logging
 import re
+import math
+import threading
 import requests
-from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from urllib.parse import urljoin, urlencode
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
 
+from _common import SCRIPT_DIR, setup_logging, load_config
 
-def setup_logging():
-    """Configure logging based on LOG_LEVEL environment variable."""
-    log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
-    logging.basicConfig(
-        level=getattr(logging, log_level, logging.INFO),
-        format='%(asctime)s - %(levelname)s - %(message)s'
-    )
-    return logging.getLogger(__name__)
+# orjson decodes the large repository listings faster than the json module
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
+logger = logging.getLogger(__name__)
 
-def load_config(config_path='config.yaml'):
-    """Load configuration from YAML file."""
-    try:
-        with open(config_path, 'r') as f:
-            config = yaml.safe_load(f)
-        return config
-    except FileNotFoundError:
-        logging.error(f"Configuration file {config_path} not found")
-        sys.exit(1)
-    except yaml.YAMLError as e:
-        logging.error(f"Error parsing YAML config: {e}")
-        sys.exit(1)
+
+# Number of result pages requested concurrently once the first page is in
+PAGE_FETCH_WORKERS = 8
+
+# Threads (and so keep-alive connections) each client keeps for page fetches
+CLIENT_WORKERS = 16
+
+# Transient API failures are retried with exponential backoff, waiting as
+# long as a 429/503 Retry-After header asks
+HTTP_RETRY = Retry(
+    total=5,
+    backoff_factor=0.5,
+    status_forcelist=[429, 500, 502, 503, 504],
+    respect_retry_after_header=True,
+    # Hand the final error response back so raise_for_status() reports it
+    raise_on_status=False,
+)
+
+# Number of projects/workspaces discovered concurrently
+DISCOVERY_WORKERS = 16
+
+# Anchored literal names, e.g. ^terraform-vpc$ or ^(vpc|eks)$. These can be
+# looked up directly instead of listing the whole project or workspace.
+LITERAL_NAME_RE = re.compile(r'\^?([A-Za-z0-9_-]+)\$')
+LITERAL_GROUP_RE = re.compile(r'\^?\((?:\?:)?([A-Za-z0-9_|-]+)\)\$')
+
+
+def literal_repo_names(repo_pattern):
+    """Return the exact repository names a pattern allows, or None for a real regex.
+
+    Patterns are applied with re.match, so a bare name like "vpc" also
+    matches "vpc-prod"; only patterns anchored with $ are treated as exact.
+    Alternations built by get_repo_pattern() are split and checked one by one.
+    """
+    if not repo_pattern:
+        return None
+    
+    group = LITERAL_GROUP_RE.fullmatch(repo_pattern)
+    if group:
+        names = group.group(1).split('|')
+        return names if all(names) else None
+    
+    names = []
+    for alternative in repo_pattern.split('|'):
+        if alternative.startswith('(?:') and alternative.endswith(')'):
+            alternative = alternative[3:-1]
+        literal = LITERAL_NAME_RE.fullmatch(alternative)
+        if not literal:
+            return None
+        names.append(literal.group(1))
+    return names
+
+
+@lru_cache(maxsize=256)
+def _compile_pattern(repo_pattern):
+    """Compile a repo pattern once, however many projects/workspaces share it."""
+    return re.compile(repo_pattern)
+
+
+def filter_by_name(repos, repo_pattern):
+    """Yield the repositories whose names match repo_pattern.
+
+    Applied only when a pattern is configured, so unfiltered discovery
+    doesn't test a pattern for every repository.
+    """
+    matcher = _compile_pattern(repo_pattern).match
+    for repo in repos:
+        repo_name = repo['name']
+        if matcher(repo_name):
+            yield repo
+        else:
+            logger.debug("Skipping %s - doesn't match pattern %s", repo_name, repo_pattern)
+
+
+# Characters allowed in a plain (unquoted) YAML scalar URL
+PLAIN_SCALAR_RE = re.compile(r'[A-Za-z][\w@.:/~+-]*')
+
+
+def yaml_scalar(value):
+    """Format a string as a YAML scalar, double-quoting it when a plain scalar won't do.
+
+    Only URL-shaped values (containing @ or ://) are left plain, since
+    they can't be read back as booleans, nulls, numbers or mapping keys.
+    """
+    if (
+        PLAIN_SCALAR_RE.fullmatch(value)
+        and ('@' in value or '://' in value)
+        and not value.endswith(':')
+    ):
+        return value
+    # JSON strings are valid YAML double-quoted scalars
+    return json.dumps(value)
+
+
+# Conditional-request cache of API responses, kept next to repos.yaml
+RESPONSE_CACHE_FILE = '.discovery-cache.json'
+
+
+class ResponseCache:
+    """ETag/Last-Modified cache of JSON API responses, persisted between runs.
+
+    Requests for cached URLs carry If-None-Match/If-Modified-Since, and a
+    304 Not Modified reply is answered from the stored body, skipping the
+    download and JSON decode. Only entries used during a run are saved.
+    """
+    
+    def __init__(self, path, entries=None):
+        self.path = path
+        self.previous = entries or {}
+        self.entries = {}
+        self.lock = threading.Lock()
+    
+    @classmethod
+    def load(cls, path):
+        """Load the cache written by the previous run, or start empty."""
+        try:
+            with open(path, 'rb') as f:
+                return cls(path, json_loads(f.read()))
+        except FileNotFoundError:
+            return cls(path)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable discovery cache %s: %s", path, e)
+            return cls(path)
+    
+    @staticmethod
+    def key(url, params):
+        """Cache key covering the URL and its query parameters."""
+        return f"{url}?{urlencode(sorted(params.items()))}" if params else url
+    
+    def validators(self, key):
+        """Conditional request headers for a cached response, if any."""
+        entry = self.previous.get(key)
+        if not entry:
+            return None
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+    
+    def revalidated(self, key):
+        """Return the stored body for a 304 response, keeping it for the next run."""
+        entry = self.previous[key]
+        with self.lock:
+            self.entries[key] = entry
+        return entry['body']
+    
+    def store(self, key, headers, body):
+        """Remember a fresh response if the server sent validators for it."""
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if etag or last_modified:
+            with self.lock:
+                self.entries[key] = {'etag': etag, 'last_modified': last_modified, 'body': body}
+    
+    def save(self):
+        """Atomically write the entries used during this run."""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+
+class BitbucketClient:
+    """HTTP plumbing shared by the Bitbucket clients.
+
+    Pages are fetched from several threads, so each thread gets its own
+    requests.Session rather than sharing one connection pool. The threads
+    belong to one pool that lives as long as the client, so the sessions'
+    keep-alive connections are reused across projects instead of paying a
+    new TLS handshake for every batch. With a ResponseCache, requests are
+    made conditional on the previous run's responses.
+    """
+    
+    def __init__(self, auth, cache=None):
+        self.auth = auth
+        self.cache = cache
+        self._local = threading.local()
+        self._pool = ThreadPoolExecutor(max_workers=CLIENT_WORKERS)
+    
+    def close(self):
+        """Shut down the fetch threads, closing their connections."""
+        self._pool.shutdown()
+    
+    @property
+    def session(self):
+        """The calling thread's session, created on first use."""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.auth = self.auth
+            adapter = HTTPAdapter(max_retries=HTTP_RETRY)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._local.session = session
+        return session
+    
+    def get_json(self, url, params=None, allow_missing=False):
+        """GET a resource and return the decoded JSON.
+
+        With allow_missing, a 404 returns None instead of raising.
+        """
+        key = ResponseCache.key(url, params)
+        headers = self.cache.validators(key) if self.cache else None
+        
+        response = self.session.get(url, params=params, headers=headers)
+        if headers and response.status_code == 304:
+            return self.cache.revalidated(key)
+        if allow_missing and response.status_code == 404:
+            return None
+        response.raise_for_status()
+        
+        # Decode the raw bytes directly; orjson skips the text decode step
+        try:
+            data = json_loads(response.content)
+        except ValueError as e:
+            # e.g. a proxy or SSO login page; report it like response.json() would
+            raise requests.exceptions.InvalidJSONError(f"Invalid JSON from {url}: {e}", response=response) from e
+        data = self.slim(data)
+        if self.cache:
+            self.cache.store(key, response.headers, data)
+        return data
+    
+    def slim(self, data):
+        """Reduce a decoded response to what discovery reads; unchanged by default."""
+        return data
+    
+    def get_page(self, url, params):
+        """GET one page of results and return the decoded JSON."""
+        return self.get_json(url, params)
+    
+    def get_pages(self, url, params_list):
+        """GET several pages concurrently, yielding them in request order."""
+        yield from self._pool.map(lambda params: self.get_page(url, params), params_list)
+    
+    def get_resource(self, url, params=None):
+        """GET a single resource, returning None if it doesn't exist."""
+        return self.get_json(url, params, allow_missing=True)
+    
+    def get_resources(self, urls, params=None):
+        """GET single resources concurrently, yielding those that exist in order."""
+        for resource in self._pool.map(lambda url: self.get_resource(url, params), urls):
+            if resource is not None:
+                yield resource
 
 
-class BitbucketServerClient:
+class BitbucketServerClient(BitbucketClient):
     """Client for Bitbucket Server API."""
     
-    def __init__(self, base_url, username, password):
+    def __init__(self, base_url, username, password, cache=None):
+        super().__init__(HTTPBasicAuth(username, password), cache)
         self.base_url = base_url.rstrip('/')
-        self.auth = HTTPBasicAuth(username, password)
-        self.session = requests.Session()
-        self.session.auth = self.auth
+    
+    @staticmethod
+    def slim_repo(repo):
+        """Keep only a repository's name and clone links."""
+        return {
+            'name': repo['name'],
+            'links': {'clone': [
+                {'name': link['name'], 'href': link['href']}
+                for link in repo.get('links', {}).get('clone', ())
+            ]},
+        }
+    
+    def slim(self, data):
+        """Drop the repository fields discovery doesn't read.
+
+        Server has no partial-response parameter like Cloud's fields, so full
+        repository objects (project, owner, web links, ...) are trimmed after
+        decoding instead. Each page is then held, and cached, at a fraction
+        of its size.
+        """
+        if 'values' in data:
+            data['values'] = [self.slim_repo(repo) for repo in data['values']]
+            return data
+        if 'name' in data:
+            return self.slim_repo(data)
+        return data
+    
+    def iter_pages(self, url, limit=100):
+        """Yield every page of a paged Server API resource in order.
+
+        Server pages carry no total count, so after the first page the next
+        PAGE_FETCH_WORKERS pages are requested at once by start offset,
+        stopping at the first page marked isLastPage.
+        """
+        data = self.get_page(url, {'start': 0, 'limit': limit})
+        yield data
+        
+        # The server may cap the page size below what was asked for
+        limit = data.get('limit', limit)
+        while not data['isLastPage']:
+            start = data['nextPageStart']
+            batch = [{'start': start + i * limit, 'limit': limit} for i in range(PAGE_FETCH_WORKERS)]
+            for data in self.get_pages(url, batch):
+                yield data
+                if data['isLastPage']:
+                    break
         
     def get_project_repos(self, project_key, repo_pattern=None):
         """Get repositories from a Bitbucket Server project."""
-        logger = logging.getLogger(__name__)
         repos = []
         
         url = f"{self.base_url}/rest/api/1.0/projects/{project_key}/repos"
+        names = literal_repo_names(repo_pattern)
         
         try:
-            logger.info(f"Fetching repositories from project: {project_key}")
+            if names:
+                # Exact names: fetch those repositories instead of listing the project
+                logger.info("Fetching %s named repositories from project: %s", len(names), project_key)
+                # Slugs are the lowercased names; the name filter below still applies
+                candidates = self.get_resources(f"{url}/{name.lower()}" for name in names)
+            else:
+                logger.info("Fetching repositories from project: %s", project_key)
+                candidates = (repo for data in self.iter_pages(url) for repo in data['values'])
             
-            start = 0
-            limit = 100
+            # Apply regex filter if provided
+            if repo_pattern:
+                candidates = filter_by_name(candidates, repo_pattern)
             
-            while True:
-                params = {'start': start, 'limit': limit}
-                response = self.session.get(url, params=params)
-                response.raise_for_status()
-                
-                data = response.json()
+            for repo in candidates:
+                repo_name = repo['name']
                 
-                for repo in data['values']:
-                    repo_name = repo['name']
-                    
-                    # Apply regex filter if provided
-                    if repo_pattern and not re.match(repo_pattern, repo_name):
-                        logger.debug(f"Skipping {repo_name} - doesn't match pattern {repo_pattern}")
-                        continue
-                    
-                    # Get SSH clone URL
-                    ssh_url = None
-                    for clone_link in repo['links']['clone']:
-                        if clone_link['name'] == 'ssh':
-                            ssh_url = clone_link['href']
-                            break
-                    
-                    if ssh_url:
-                        repos.append(ssh_url)
-                        logger.debug(f"Added repository: {ssh_url}")
-                    else:
-                        logger.warning(f"No SSH clone URL found for {repo_name}")
-                
-                # Check if there are more pages
-                if data['isLastPage']:
-                    break
-                    
-                start = data['nextPageStart']
+                # Get SSH clone URL
+                ssh_url = next(
+                    (clone_link['href'] for clone_link in repo['links']['clone'] if clone_link['name'] == 'ssh'),
+                    None
+                )
                 
+                if ssh_url:
+                    repos.append(ssh_url)
+                    logger.debug("Added repository: %s", ssh_url)
+                else:
+                    logger.warning("No SSH clone URL found for %s", repo_name)
+            
         except requests.exceptions.RequestException as e:
-            logger.error(f"Error fetching repositories from project {project_key}: {e}")
+            logger.error("Error fetching repositories from project %s: %s", project_key, e)
             
         return repos
 
 
-class BitbucketCloudClient:
+# Partial responses: only the fields discovery reads (plus paging metadata)
+CLOUD_REPO_FIELDS = 'name,links.clone.name,links.clone.href'
+CLOUD_PAGE_FIELDS = 'next,size,pagelen,' + ','.join(
+    f'values.{field}' for field in CLOUD_REPO_FIELDS.split(',')
+)
+
+
+class BitbucketCloudClient(BitbucketClient):
     """Client for Bitbucket Cloud API."""
     
-    def __init__(self, username, app_password):
-        self.auth = HTTPBasicAuth(username, app_password)
-        self.session = requests.Session()
-        self.session.auth = self.auth
+    def __init__(self, username, app_password, cache=None):
+        super().__init__(HTTPBasicAuth(username, app_password), cache)
         self.base_url = "https://api.bitbucket.org/2.0"
+    
+    def iter_pages(self, url, pagelen=100):
+        """Yield every page of a paginated Cloud API resource in order.
+
+        The first page reports the total result count in 'size', so the
+        remaining pages are requested concurrently by page number. Without
+        a count, the 'next' links are followed one page at a time.
+        """
+        data = self.get_page(url, {'page': 1, 'pagelen': pagelen, 'fields': CLOUD_PAGE_FIELDS})
+        yield data
+        
+        if 'next' not in data:
+            return
+        
+        pagelen = data.get('pagelen', pagelen)
+        if 'size' in data:
+            page_count = math.ceil(data['size'] / pagelen)
+            yield from self.get_pages(
+                url, [
+                    {'page': page, 'pagelen': pagelen, 'fields': CLOUD_PAGE_FIELDS}
+                    for page in range(2, page_count + 1)
+                ]
+            )
+            return
+        
+        # 'next' links carry the original query, fields included
+        while 'next' in data:
+            data = self.get_page(data['next'], None)
+            yield data
         
     def get_workspace_repos(self, workspace_name, repo_pattern=None):
         """Get repositories from a Bitbucket Cloud workspace."""
-        logger = logging.getLogger(__name__)
         repos = []
         
         url = f"{self.base_url}/repositories/{workspace_name}"
+        names = literal_repo_names(repo_pattern)
         
         try:
-            logger.info(f"Fetching repositories from workspace: {workspace_name}")
+            if names:
+                # Exact names: fetch those repositories instead of listing the workspace
+                logger.info("Fetching %s named repositories from workspace: %s", len(names), workspace_name)
+                # Slugs are the lowercased names; the name filter below still applies
+                candidates = self.get_resources(
+                    (f"{url}/{name.lower()}" for name in names), {'fields': CLOUD_REPO_FIELDS}
+                )
+            else:
+                logger.info("Fetching repositories from workspace: %s", workspace_name)
+                candidates = (repo for data in self.iter_pages(url) for repo in data['values'])
             
-            page = 1
+            # Apply regex filter if provided
+            if repo_pattern:
+                candidates = filter_by_name(candidates, repo_pattern)
             
-            while True:
-                params = {'page': page, 'pagelen': 100}
-                response = self.session.get(url, params=params)
-                response.raise_for_status()
-                
-                data = response.json()
-                
-                for repo in data['values']:
-                    repo_name = repo['name']
-                    
-                    # Apply regex filter if provided
-                    if repo_pattern and not re.match(repo_pattern, repo_name):
-                        logger.debug(f"Skipping {repo_name} - doesn't match pattern {repo_pattern}")
-                        continue
-                    
-                    # Get SSH clone URL
-                    ssh_url = None
-                    if 'links' in repo and 'clone' in repo['links']:
-                        for clone_link in repo['links']['clone']:
-                            if clone_link['name'] == 'ssh':
-                                ssh_url = clone_link['href']
-                                break
-                    
-                    if ssh_url:
-                        repos.append(ssh_url)
-                        logger.debug(f"Added repository: {ssh_url}")
-                    else:
-                        logger.warning(f"No SSH clone URL found for {repo_name}")
+            for repo in candidates:
+                repo_name = repo['name']
                 
-                # Check if there are more pages
-                if 'next' not in data:
-                    break
-                    
-                page += 1
+                # Get SSH clone URL; repositories without clone links have none
+                clone_links = repo.get('links', {}).get('clone', ())
+                ssh_url = next(
+                    (clone_link['href'] for clone_link in clone_links if clone_link['name'] == 'ssh'),
+                    None
+                )
                 
+                if ssh_url:
+                    repos.append(ssh_url)
+                    logger.debug("Added repository: %s", ssh_url)
+                else:
+                    logger.warning("No SSH clone URL found for %s", repo_name)
+            
         except requests.exceptions.RequestException as e:
-            logger.error(f"Error fetching repositories from workspace {workspace_name}: {e}")
+            logger.error("Error fetching repositories from workspace %s: %s", workspace_name, e)
             
         return repos
 
 
-def discover_repositories(config):
-    """Discover repositories from configured Bitbucket instances."""
-    logger = logging.getLogger(__name__)
-    all_repos = []
+def get_repo_pattern(entry):
+    """Combine a project/workspace entry's repo_pattern and repo_patterns into one regex.
+
+    Multiple patterns become a single alternation, so each name is matched
+    with one regex scan. Returns None when the entry has no filter.
+    """
+    patterns = list(entry.get('repo_patterns') or [])
+    if entry.get('repo_pattern'):
+        patterns.insert(0, entry['repo_pattern'])
+    
+    if not patterns:
+        return None
+    if len(patterns) == 1:
+        return patterns[0]
+    return '|'.join(f'(?:{pattern})' for pattern in patterns)
+
+
+def templated_repos(entries, ssh_template):
+    """Build SSH URLs from ssh_template when every entry names its repositories exactly.
+
+    Returns the URLs, or None if there is no template or some entry needs
+    the API (an unfiltered entry or a real regex). The template is formatted
+    with {project} and {repo}, the project/workspace and repository names
+    as configured.
+    """
+    if not ssh_template:
+        return None
+    
+    repos = []
+    for entry in entries:
+        names = literal_repo_names(get_repo_pattern(entry))
+        if not names:
+            return None
+        repos.extend(ssh_template.format(project=entry['name'], repo=name) for name in names)
+    return repos
+
+
+def discover_repositories(config, cache=None):
+    """Discover repositories from configured Bitbucket instances.
+
+    Returns the unique SSH URLs in discovery order. An optional
+    ResponseCache is shared by the Server and Cloud clients.
+    """
+    # Insertion-ordered set: duplicates are dropped as URLs arrive
+    all_repos = {}
     
     bitbucket_config = config.get('bitbucket', {})
     
@@ -201,103 +542,142 @@ def discover_repositories(config):
     if server_config:
         logger.info("Processing Bitbucket Server repositories")
         
-        server_url = server_config['url']
-        username = server_config['username']
-        password = server_config.get('password') or os.getenv('BITBUCKET_SERVER_PASSWORD')
+        projects = server_config.get('projects', [])
+        templated = templated_repos(projects, server_config.get('ssh_template'))
         
-        if not password:
-            logger.error("Bitbucket Server password not found in config or BITBUCKET_SERVER_PASSWORD env var")
-            return []
+        if templated is not None:
+            # Every project names its repositories, so no API requests are needed
+            all_repos.update(dict.fromkeys(templated))
+            logger.info("Built %s repository URLs from the Bitbucket Server ssh_template", len(templated))
+        else:
+            server_url = server_config['url']
+            username = server_config['username']
+            password = server_config.get('password') or os.getenv('BITBUCKET_SERVER_PASSWORD')
             
-        client = BitbucketServerClient(server_url, username, password)
-        
-        for project in server_config.get('projects', []):
-            project_name = project['name']
-            repo_pattern = project.get('repo_pattern')
+            if not password:
+                logger.error("Bitbucket Server password not found in config or BITBUCKET_SERVER_PASSWORD env var")
+                return []
+                
+            client = BitbucketServerClient(server_url, username, password, cache)
             
-            repos = client.get_project_repos(project_name, repo_pattern)
-            all_repos.extend(repos)
-            logger.info(f"Found {len(repos)} repositories in project {project_name}")
+            # Projects are independent, so fetch them concurrently
+            try:
+                with ThreadPoolExecutor(max_workers=DISCOVERY_WORKERS) as pool:
+                    results = pool.map(
+                        lambda project: client.get_project_repos(project['name'], get_repo_pattern(project)),
+                        projects
+                    )
+                    for project, repos in zip(projects, results):
+                        all_repos.update(dict.fromkeys(repos))
+                        logger.info("Found %s repositories in project %s", len(repos), project['name'])
+            finally:
+                client.close()
     
     # Process Bitbucket Cloud instances
     cloud_config = bitbucket_config.get('cloud')
     if cloud_config:
         logger.info("Processing Bitbucket Cloud repositories")
         
-        username = cloud_config['username']
-        app_password = cloud_config.get('app_password') or os.getenv('BITBUCKET_CLOUD_APP_PASSWORD')
+        workspaces = cloud_config.get('workspaces', [])
+        templated = templated_repos(workspaces, cloud_config.get('ssh_template'))
         
-        if not app_password:
-            logger.error("Bitbucket Cloud app password not found in config or BITBUCKET_CLOUD_APP_PASSWORD env var")
-            return []
+        if templated is not None:
+            # Every workspace names its repositories, so no API requests are needed
+            all_repos.update(dict.fromkeys(templated))
+            logger.info("Built %s repository URLs from the Bitbucket Cloud ssh_template", len(templated))
+        else:
+            username = cloud_config['username']
+            app_password = cloud_config.get('app_password') or os.getenv('BITBUCKET_CLOUD_APP_PASSWORD')
             
-        client = BitbucketCloudClient(username, app_password)
-        
-        for workspace in cloud_config.get('workspaces', []):
-            workspace_name = workspace['name']
-            repo_pattern = workspace.get('repo_pattern')
+            if not app_password:
+                logger.error("Bitbucket Cloud app password not found in config or BITBUCKET_CLOUD_APP_PASSWORD env var")
+                return []
+                
+            client = BitbucketCloudClient(username, app_password, cache)
             
-            repos = client.get_workspace_repos(workspace_name, repo_pattern)
-            all_repos.extend(repos)
-            logger.info(f"Found {len(repos)} repositories in workspace {workspace_name}")
+            # Workspaces are independent, so fetch them concurrently
+            try:
+                with ThreadPoolExecutor(max_workers=DISCOVERY_WORKERS) as pool:
+                    results = pool.map(
+                        lambda workspace: client.get_workspace_repos(workspace['name'], get_repo_pattern(workspace)),
+                        workspaces
+                    )
+                    for workspace, repos in zip(workspaces, results):
+                        all_repos.update(dict.fromkeys(repos))
+                        logger.info("Found %s repositories in workspace %s", len(repos), workspace['name'])
+            finally:
+                client.close()
     
-    return all_repos
+    return list(all_repos)
 
 
 def write_repos_yaml(repos, output_path='repos.yaml'):
-    """Write discovered repositories to a YAML file."""
-    logger = logging.getLogger(__name__)
-    
-    output_config = {
-        'repositories': repos
-    }
-    
+    """Write discovered repositories to a YAML file.
+
+    The document is a single list of strings, so it is written directly
+    rather than through the YAML emitter.
+    """
     try:
         with open(output_path, 'w') as f:
-            yaml.dump(output_config, f, default_flow_style=False, sort_keys=False)
+            f.write('repositories:\n' if repos else 'repositories: []\n')
+            f.writelines(f'- {yaml_scalar(repo)}\n' for repo in repos)
         
-        logger.info(f"Successfully wrote {len(repos)} repositories to {output_path}")
+        logger.info("Successfully wrote %s repositories to %s", len(repos), output_path)
         
     except Exception as e:
-        logger.error(f"Error writing repos to {output_path}: {e}")
+        logger.error("Error writing repos to %s: %s", output_path, e)
         sys.exit(1)
 
 
-def main():
-    """Main function to discover repositories and generate repos.yaml."""
-    logger = setup_logging()
-    
-    # Get config file path from command line or use default
-    config_path = sys.argv[1] if len(sys.argv) > 1 else 'config.yaml'
-    
+def run(config):
+    """Run repository discovery and write repos.yaml. Returns True on success."""
     logger.info("Starting repository discovery")
     
-    # Load configuration
-    config = load_config(config_path)
-    
     if 'bitbucket' not in config:
         logger.error("No 'bitbucket' section found in config")
-        sys.exit(1)
+        return False
     
-    # Discover repositories
-    repos = discover_repositories(config)
+    # Revalidate against the previous run's responses unless disabled
+    cache = None
+    if config.get('discovery_cache', True):
+        cache = ResponseCache.load(os.path.join(SCRIPT_DIR, RESPONSE_CACHE_FILE))
     
-    if not repos:
-        logger.warning("No repositories found")
-        sys.exit(1)
+    # Discover repositories (already de-duplicated, in discovery order)
+    unique_repos = discover_repositories(config, cache)
     
-    # Remove duplicates while preserving order
-    unique_repos = list(dict.fromkeys(repos))
+    if cache:
+        try:
+            cache.save()
+        except OSError as e:
+            logger.warning("Could not write discovery cache %s: %s", cache.path, e)
+    
+    if not unique_repos:
+        logger.warning("No repositories found")
+        return False
     
-    logger.info(f"Discovered {len(unique_repos)} unique repositories")
+    logger.info("Discovered %s unique repositories", len(unique_repos))
     
     # Write to repos.yaml
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    output_path = os.path.join(script_dir, 'repos.yaml')
+    output_path = os.path.join(SCRIPT_DIR, 'repos.yaml')
     write_repos_yaml(unique_repos, output_path)
     
     logger.info("Repository discovery completed successfully")
+    return True
+
+
+def main():
+    """Main function to discover repositories and generate repos.yaml."""
+    setup_logging()
+    
+    # Get config file path from command line or use default
+    config_path = sys.argv[1] if len(sys.argv) > 1 else 'config.yaml'
+    
+    # Load configuration
+    config = load_config(config_path)
+    
+    if not run(config):
+        sys.exit(1)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()